@@ -1,17 +1,26 @@
-from functools import lru_cache
-import time
+import asyncio
+
+from cachetools import TTLCache
 
-chat_cache = {}
 CHAT_CACHE_TTL = 60*60*12
+chat_cache = TTLCache(maxsize=10000, ttl=CHAT_CACHE_TTL)
+chat_fetches = {}
 
-async def get_chat_cached(app, chat_id):
-    current_time = time.time()
-    
-    if chat_id in chat_cache:
-        cache_time, chat_data = chat_cache[chat_id]
-        if current_time - cache_time < CHAT_CACHE_TTL:
-            return chat_data
-    
+async def fetch_chat(app, chat_id):
     chat_data = await app.get_chat(chat_id)
-    chat_cache[chat_id] = (current_time, chat_data)
-    return chat_data
\ No newline at end of file
+    chat_cache[chat_id] = chat_data
+    return chat_data
+
+async def get_chat_cached(app, chat_id):
+    try:
+        return chat_cache[chat_id]
+    except KeyError:
+        pass
+
+    # Concurrent misses for the same chat share one in-flight get_chat call
+    fetch = chat_fetches.get(chat_id)
+    if fetch is None:
+        fetch = asyncio.ensure_future(fetch_chat(app, chat_id))
+        chat_fetches[chat_id] = fetch
+        fetch.add_done_callback(lambda _: chat_fetches.pop(chat_id, None))
+    return await asyncio.shield(fetch)
@@ -1,15 +1,16 @@
 import asyncio
 import os
+import re
 import signal
 import sys
 import time
 import psutil
 import subprocess
-from datetime import datetime
 import logging
 from collections import deque
 import shutil
 from pathlib import Path
+from inotify_simple import INotify, flags
 
 # Configure logging
 logging.basicConfig(
@@ -33,31 +34,42 @@ class LogMonitor:
             "ClientConnectorError",
             "socket.send() raised exception"  # Added socket send error
         ]
+        self.critical_re = re.compile(b'|'.join(re.escape(err.encode()) for err in self.critical_errors))
         self.socket_errors = deque(maxlen=10)  # Track last 10 socket errors
+        self.last_socket_ts = None  # Monotonic time of the previous socket error
+        self.fd = None  # Persistent read-only descriptor for log_file
+        self.read_size = 1 << 20  # Read at most 1MB of new log data per check
+        self.log_changed = True  # Read once on first check before relying on events
+        self.changed = asyncio.Event()  # Set while log_changed is pending
+        self.changed.set()
+        self.loop = None  # Loop the inotify reader is registered on
+        try:
+            # Watch the directory so the log can be created or replaced later
+            self.inotify = INotify()
+            log_dir = os.path.dirname(os.path.abspath(self.log_file))
+            self.inotify.add_watch(log_dir, flags.MODIFY | flags.CREATE | flags.MOVED_TO)
+        except OSError as e:
+            logging.warning(f"inotify unavailable, falling back to polling logs: {e}")
+            self.inotify = None
 
     async def analyze_socket_error(self, error_line):
         """Analyze socket.send() errors for patterns"""
         try:
-            # Extract timestamp and context
-            timestamp = error_line[:19]  # Assuming format [dd-mm-yyyy HH:MM:SS]
+            # Record when the error was seen, the log timestamp is not parsed
+            now = time.monotonic()
+            last = self.last_socket_ts
+            self.last_socket_ts = now
             self.socket_errors.append({
-                'timestamp': timestamp,
+                'timestamp': now,
                 'full_error': error_line,
                 'count': len(self.socket_errors) + 1
             })
             
             # Analysis of multiple socket errors
-            if len(self.socket_errors) >= 3:
-                time_diffs = []
-                for i in range(len(self.socket_errors) - 1):
-                    t1 = datetime.strptime(self.socket_errors[i]['timestamp'], '%d-%m-%Y %H:%M:%S')
-                    t2 = datetime.strptime(self.socket_errors[i + 1]['timestamp'], '%d-%m-%Y %H:%M:%S')
-                    time_diffs.append((t2 - t1).total_seconds())
-                
-                # If errors are happening too frequently
-                if any(diff < 60 for diff in time_diffs):
-                    logging.warning("Multiple socket.send() errors detected in short period")
-                    return "frequent_socket_errors"
+            # If errors are happening too frequently
+            if len(self.socket_errors) >= 3 and now - last < 60:
+                logging.warning("Multiple socket.send() errors detected in short period")
+                return "frequent_socket_errors"
             
             return None
         except Exception as e:
@@ -67,35 +79,110 @@ class LogMonitor:
     async def check_logs(self):
         """Monitor log file for errors with enhanced socket error tracking"""
         try:
+            if not self.has_log_changed():
+                return None
+
             if not os.path.exists(self.log_file):
                 return None
 
-            with open(self.log_file, 'r') as f:
-                # Seek to last read position
-                f.seek(self.last_position)
-                new_lines = f.readlines()
-                self.last_position = f.tell()
-
-                # Process new lines
-                for line in new_lines:
-                    if "socket.send() raised exception" in line:
-                        self.error_history.append(line.strip())
-                        return await self.analyze_socket_error(line.strip())
-                    elif "ERROR" in line:
-                        self.error_history.append(line.strip())
-                        # Check for critical errors
-                        if any(err in line for err in self.critical_errors):
-                            return line.strip()
+            size = self.open_log()
+            if size < self.last_position:
+                self.last_position = 0  # Log was truncated
+
+            # Read new data since last position
+            os.lseek(self.fd, self.last_position, os.SEEK_SET)
+            buf = os.read(self.fd, self.read_size)
+            if len(buf) == self.read_size:
+                # Leave a partial trailing line for the next check
+                end = buf.rfind(b'\n') + 1
+                if end:
+                    buf = buf[:end]
+                self.mark_changed()  # More data is pending
+            self.last_position += len(buf)
+
+            # Skip line splitting entirely when nothing of interest was logged
+            if buf.find(b"socket.send() raised exception") == -1 and buf.find(b"ERROR") == -1:
+                return None
+
+            # Process new lines as bytes, only the returned line is decoded
+            for line in buf.splitlines():
+                if b"socket.send() raised exception" in line:
+                    self.error_history.append(line.strip())
+                    return await self.analyze_socket_error(line.strip())
+                elif b"ERROR" in line:
+                    self.error_history.append(line.strip())
+                    # Check for critical errors
+                    if self.critical_re.search(line):
+                        return line.strip().decode(errors='replace')
 
             return None
 
         except Exception as e:
+            self.mark_changed()  # Retry on the next check, events were already drained
             logging.error(f"Error reading logs: {str(e)}")
             return None
 
+    def watch(self):
+        """Read inotify events as soon as the kernel reports them"""
+        if self.inotify is not None:
+            self.loop = asyncio.get_running_loop()
+            self.loop.add_reader(self.inotify.fd, self.read_events)
+
+    def read_events(self):
+        """Drain pending inotify events and note whether the log was written"""
+        name = os.path.basename(self.log_file)
+        for event in self.inotify.read(timeout=0):
+            # On queue overflow events were dropped, assume the log changed
+            if event.name == name or event.mask & flags.Q_OVERFLOW:
+                self.mark_changed()
+
+    def mark_changed(self):
+        """Flag the log as changed and wake wait_for_change"""
+        self.log_changed = True
+        self.changed.set()
+
+    async def wait_for_change(self):
+        """Sleep until inotify reports a write to the log"""
+        await self.changed.wait()
+
+    def has_log_changed(self):
+        """Consume the pending change flag, reading any queued events first"""
+        if self.inotify is None:
+            return True
+
+        self.read_events()
+        changed = self.log_changed
+        self.log_changed = False
+        self.changed.clear()
+        return changed
+
+    def open_log(self):
+        """Open the log file once, reopening if it was replaced. Returns its size"""
+        st = os.stat(self.log_file)
+        if self.fd is not None:
+            if os.fstat(self.fd).st_ino == st.st_ino:
+                return st.st_size
+            os.close(self.fd)
+            self.fd = None
+        self.fd = os.open(self.log_file, os.O_RDONLY)
+        self.last_position = 0
+        return st.st_size
+
+    def close(self):
+        """Release the log and inotify descriptors"""
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+        if self.inotify is not None:
+            if self.loop is not None:
+                self.loop.remove_reader(self.inotify.fd)
+                self.loop = None
+            self.inotify.close()
+            self.inotify = None
+
     def get_last_error(self):
         """Get the most recent error from history"""
-        return self.error_history[-1] if self.error_history else None
+        return self.error_history[-1].decode(errors='replace') if self.error_history else None
 
 class StorageMonitor:
     def __init__(self, base_path):
@@ -103,6 +190,7 @@ class StorageMonitor:
         self.downloads_path = self.base_path / 'downloads'
         self.cache_path = self.base_path / 'cache'
         self.min_free_space = 1024 * 1024 * 1024  # 1GB minimum free space
+        self.removing = set()  # Old directories a background job is deleting
 
     def check_storage(self):
         """Check storage space and clean if necessary"""
@@ -118,24 +206,65 @@ class StorageMonitor:
             logging.error(f"Storage check error: {e}")
             return False
 
+    def directory_size(self, root):
+        """Total size of files under root using cached scandir entries"""
+        total = 0
+        stack = [root]
+        while stack:
+            with os.scandir(stack.pop()) as it:
+                for entry in it:
+                    if entry.is_dir(follow_symlinks=False):
+                        stack.append(entry.path)
+                    elif entry.is_file():
+                        total += entry.stat().st_size
+        return total
+
     def clean_directories(self):
         """Clean downloads and cache directories"""
         try:
-            cleaned_size = 0
+            stale = []
             for directory in [self.downloads_path, self.cache_path]:
+                # Leftovers from an earlier clean that did not finish
+                stale.extend(
+                    old for old in directory.parent.glob(f"{directory.name}.old-*")
+                    if old not in self.removing
+                )
                 if directory.exists():
-                    size = sum(f.stat().st_size for f in directory.glob('**/*') if f.is_file())
-                    shutil.rmtree(directory)
+                    # Swap in an empty directory, old contents are removed in the background
+                    old = directory.with_name(f"{directory.name}.old-{time.time_ns()}")
+                    os.rename(directory, old)
                     directory.mkdir(exist_ok=True)
-                    cleaned_size += size
-            
-            if cleaned_size > 0:
-                logging.info(f"Cleaned {cleaned_size / (1024*1024):.2f}MB from downloads/cache")
+                    stale.append(old)
+
+            if stale:
+                self.removing.update(stale)
+                asyncio.get_running_loop().run_in_executor(None, self.remove_directories, stale)
             return True
         except Exception as e:
             logging.error(f"Error cleaning directories: {e}")
             return False
 
+    def remove_directories(self, directories):
+        """Delete renamed-away directories, run off the event loop"""
+        cleaned_size = 0
+        log_size = logging.getLogger().isEnabledFor(logging.INFO)
+        for directory in directories:
+            try:
+                if log_size:
+                    cleaned_size += self.directory_size(directory)
+            except OSError as e:
+                logging.warning(f"Could not size {directory}: {e}")
+
+            try:
+                shutil.rmtree(directory)
+            except Exception as e:
+                logging.error(f"Error removing {directory}: {e}")
+            finally:
+                self.removing.discard(directory)
+
+        if cleaned_size > 0:
+            logging.info(f"Cleaned {cleaned_size / (1024*1024):.2f}MB from downloads/cache")
+
 class CPUMonitor:
     def __init__(self):
         self.high_cpu_history = deque(maxlen=10)  # Track last 10 high CPU readings
@@ -171,6 +300,8 @@ class CPUMonitor:
 class BotWatchdog:
     def __init__(self):
         self.bot_process = None
+        self.stop_event = asyncio.Event()  # Set to shut the watchdog down
+        self.exit_code = 0
         self.restart_count = 0
         self.max_restarts = 5
         self.restart_interval = 60
@@ -178,7 +309,9 @@ class BotWatchdog:
         self.bot_script = "python3 -m AnonXMusic"
         self.working_dir = os.path.dirname(os.path.abspath(__file__))
         self.log_monitor = LogMonitor()
-        self.log_check_interval = 30  # Increased from 10 to 30 seconds
+        self.health_check_interval = 30  # Seconds between health checks
+        self.log_check_interval = 10  # Seconds between log checks without inotify
+        self.log_debounce = 1  # Minimum seconds between inotify-driven log checks
         self.storage_monitor = StorageMonitor(self.working_dir)
         self.storage_check_interval = 900  # Increased from 300 to 900 seconds (15 minutes)
         self.cpu_monitor = CPUMonitor()
@@ -206,6 +339,9 @@ class BotWatchdog:
             "Bot Started Successfully"
         ]
         self.startup_timeout = 30  # Seconds to wait for full startup
+        self.last_cpu_times = None  # (cpu seconds, monotonic time) of last sample
+        self.bot_proc = None  # Cached psutil.Process for the bot
+        self.mem_total = psutil.virtual_memory().total  # Read once, not per health check
 
     async def start_bot(self):
         """Start the bot process with enhanced startup verification"""
@@ -217,16 +353,19 @@ class BotWatchdog:
                 with open('log.txt', 'w') as f:
                     f.truncate(0)
 
-            self.kill_bot()
+            await self.kill_bot()
             await asyncio.sleep(2)
 
-            self.bot_process = subprocess.Popen(
-                self.bot_script.split(),
+            # Output is discarded, the bot logs to log.txt and an undrained
+            # pipe would eventually block it
+            self.bot_process = await asyncio.create_subprocess_exec(
+                *self.bot_script.split(),
                 cwd=self.working_dir,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                preexec_fn=os.setsid
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL,
+                start_new_session=True
             )
+            self.last_cpu_times = None
 
             # Wait for proper startup
             if await self.verify_startup():
@@ -234,30 +373,46 @@ class BotWatchdog:
                 return True
             
             logging.error("Bot failed to start properly")
-            self.kill_bot()
+            await self.kill_bot()
             return False
 
         except Exception as e:
             logging.error(f"Failed to start bot: {str(e)}")
             return False
 
-    def kill_bot(self):
+    async def kill_bot(self):
         """Kill the bot process and all its children"""
         if not self.bot_process:
             return
         
         try:
-            parent = psutil.Process(self.bot_process.pid)
-            for child in parent.children(recursive=True):
-                child.terminate()
-            parent.terminate()
+            # The bot runs in its own session, signal the whole group at once.
+            # setsid makes the group id equal to the bot pid, which stays valid
+            # for surviving children even after the bot itself was reaped
+            pgid = self.bot_process.pid
+            os.killpg(pgid, signal.SIGTERM)
+            try:
+                await asyncio.wait_for(self.bot_process.wait(), timeout=2)
+            except asyncio.TimeoutError:
+                os.killpg(pgid, signal.SIGKILL)
+                try:
+                    await asyncio.wait_for(self.bot_process.wait(), timeout=2)
+                except asyncio.TimeoutError:
+                    logging.error(f"Bot process {pgid} did not exit after SIGKILL")
             logging.info(f"Bot process {self.bot_process.pid} terminated")
-        except psutil.NoSuchProcess:
+        except ProcessLookupError:
             pass
         except Exception as e:
             logging.error(f"Error killing bot process: {str(e)}")
         
         self.bot_process = None
+        self.bot_proc = None
+
+    def get_bot_proc(self):
+        """Return a cached psutil.Process for the running bot"""
+        if self.bot_proc is None or self.bot_proc.pid != self.bot_process.pid:
+            self.bot_proc = psutil.Process(self.bot_process.pid)
+        return self.bot_proc
 
     async def check_bot_activity(self):
         """Enhanced check if bot is actually responding and working"""
@@ -328,26 +483,44 @@ class BotWatchdog:
             logging.error(f"Startup verification error: {e}")
             return False
 
+    def sample_cpu_percent(self, cpu_times):
+        """Compute CPU usage since the previous sample without blocking"""
+        now = time.monotonic()
+        total = cpu_times.user + cpu_times.system
+        last = self.last_cpu_times
+        self.last_cpu_times = (total, now)
+
+        if last is None or now <= last[1]:
+            return 0.0
+        return (total - last[0]) / (now - last[1]) * 100
+
     async def check_bot_health(self):
         """Enhanced health check with both process and activity monitoring"""
         if not self.bot_process:
             return False
 
+        if self.bot_process.returncode is not None:
+            logging.warning(f"Bot process exited with code {self.bot_process.returncode}")
+            return False
+
         try:
-            process = psutil.Process(self.bot_process.pid)
-            
-            # Basic process checks
-            if process.status() == psutil.STATUS_ZOMBIE:
-                logging.warning("Bot process is zombie")
-                return False
+            process = self.get_bot_proc()
 
-            # Check if process is responding
+            # Read all process attributes from a single /proc parse
             try:
-                process.cpu_percent()  # This will raise if process is dead
-            except (psutil.NoSuchProcess, psutil.ZombieProcess):
+                with process.oneshot():
+                    status = process.status()
+                    mem_percent = process.memory_info().rss * 100 / self.mem_total
+                    cpu_times = process.cpu_times()
+            except psutil.ZombieProcess:
                 logging.warning("Bot process is unresponsive")
                 return False
 
+            # Basic process checks
+            if status == psutil.STATUS_ZOMBIE:
+                logging.warning("Bot process is zombie")
+                return False
+
             # Check if bot is actually active
             is_active = await self.check_bot_activity()
             if not is_active:
@@ -355,13 +528,12 @@ class BotWatchdog:
                 return False
 
             # Memory leak check
-            mem_percent = process.memory_percent()
             if mem_percent > 90:
                 logging.warning(f"High memory usage detected: {mem_percent}%")
                 return False
 
             # Enhanced CPU monitoring
-            cpu_percent = process.cpu_percent(interval=1)
+            cpu_percent = self.sample_cpu_percent(cpu_times)
             current_time = time.time()
             self.cpu_monitor.add_cpu_reading(cpu_percent, current_time)
 
@@ -377,38 +549,51 @@ class BotWatchdog:
                         return False
                     else:
                         logging.error("Max force restarts reached due to CPU issues")
-                        sys.exit(1)
+                        self.stop(1)
+                        return False
 
             return True
 
         except psutil.NoSuchProcess:
+            self.bot_proc = None
             logging.warning("Bot process no longer exists")
             return False
         except Exception as e:
             logging.error(f"Health check error: {str(e)}")
             return False
 
+    def stop(self, exit_code=0):
+        """Ask monitor_loop to stop and exit with the given code"""
+        self.exit_code = exit_code
+        self.stop_event.set()
+
     async def monitor_loop(self):
-        """Main monitoring loop with enhanced error tracking"""
-        log_check_counter = 0
-        storage_check_counter = 0
-        
+        """Run health, log and storage checks as independent periodic tasks until stopped"""
+        tasks = [
+            asyncio.create_task(self.health_task()),
+            asyncio.create_task(self.log_task()),
+            asyncio.create_task(self.storage_task())
+        ]
+        try:
+            await self.stop_event.wait()
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def health_task(self):
+        """Check bot health and restart it when needed"""
         while True:
             try:
                 # Reset force restart count periodically
                 if time.time() - self.last_restart > 7200:  # 2 hours
                     self.force_restart_count = 0
 
-                # Check storage periodically
-                storage_check_counter += 1
-                if storage_check_counter >= self.storage_check_interval:
-                    storage_check_counter = 0
-                    if not self.storage_monitor.check_storage():
-                        logging.warning("Low storage space detected, cleaning directories")
-                        self.storage_monitor.clean_directories()
-
                 # Check bot health
                 if not await self.check_bot_health():
+                    if self.stop_event.is_set():
+                        return
+
                     # Check logs for errors before restart
                     last_error = self.log_monitor.get_last_error()
                     
@@ -424,7 +609,7 @@ class BotWatchdog:
                     if current_time - self.last_restart > self.restart_interval:
                         if self.restart_count < self.max_restarts:
                             logging.warning("Bot is not running. Attempting restart...")
-                            self.kill_bot()
+                            await self.kill_bot()
                             if await self.start_bot():
                                 self.restart_count += 1
                                 self.last_restart = current_time
@@ -433,45 +618,78 @@ class BotWatchdog:
                             logging.error("Max restart attempts reached. Manual intervention required.")
                             if last_error:
                                 logging.error(f"Final error that caused shutdown: {last_error}")
-                            sys.exit(1)
+                            self.stop(1)
+                            return
                 else:
-                    # Check logs periodically
-                    log_check_counter += 1
-                    if log_check_counter >= self.log_check_interval:
-                        log_check_counter = 0
-                        critical_error = await self.log_monitor.check_logs()
-                        if critical_error:
-                            logging.warning(f"Critical error detected: {critical_error}")
-
                     # Reset restart count if bot has been stable
                     if time.time() - self.last_restart > 3600:
                         self.restart_count = 0
                 
-                await asyncio.sleep(30)  # Increased from 1 to 30 seconds
+                await asyncio.sleep(self.health_check_interval)
                 
             except Exception as e:
-                logging.error(f"Monitor loop error: {str(e)}")
+                logging.error(f"Health task error: {str(e)}")
                 await asyncio.sleep(5)
 
-    def handle_signal(self, signum, frame):
+    async def log_task(self):
+        """Check logs for critical errors whenever inotify reports a write"""
+        while True:
+            try:
+                if self.log_monitor.inotify is None:
+                    await asyncio.sleep(self.log_check_interval)
+                else:
+                    await self.log_monitor.wait_for_change()
+
+                critical_error = await self.log_monitor.check_logs()
+                if critical_error:
+                    logging.warning(f"Critical error detected: {critical_error}")
+
+                if self.log_monitor.inotify is not None:
+                    # Coalesce bursts of writes into one read
+                    await asyncio.sleep(self.log_debounce)
+
+            except Exception as e:
+                logging.error(f"Log task error: {str(e)}")
+                await asyncio.sleep(5)
+
+    async def storage_task(self):
+        """Check storage space and clean directories when low"""
+        while True:
+            try:
+                await asyncio.sleep(self.storage_check_interval)
+                if not self.storage_monitor.check_storage():
+                    logging.warning("Low storage space detected, cleaning directories")
+                    self.storage_monitor.clean_directories()
+
+            except Exception as e:
+                logging.error(f"Storage task error: {str(e)}")
+                await asyncio.sleep(5)
+
+    def handle_signal(self, signum):
         """Handle termination signals"""
         logging.info(f"Received signal {signum}. Shutting down...")
-        self.kill_bot()
-        sys.exit(0)
+        self.stop(0)
 
     async def run(self):
         """Start the watchdog"""
-        signal.signal(signal.SIGTERM, self.handle_signal)
-        signal.signal(signal.SIGINT, self.handle_signal)
+        loop = asyncio.get_running_loop()
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            loop.add_signal_handler(signum, self.handle_signal, signum)
         
         logging.info("Starting bot watchdog with log monitoring...")
-        await self.start_bot()
-        await self.monitor_loop()
+        self.log_monitor.watch()
+        try:
+            await self.start_bot()
+            await self.monitor_loop()
+        finally:
+            # Also runs when asyncio.run cancels us on KeyboardInterrupt
+            await self.kill_bot()
+            self.log_monitor.close()
+        return self.exit_code
 
 if __name__ == "__main__":
     watchdog = BotWatchdog()
     try:
-        asyncio.run(watchdog.run())
+        sys.exit(asyncio.run(watchdog.run()))
     except KeyboardInterrupt:
         logging.info("Watchdog stopped by user")
-        watchdog.kill_bot()